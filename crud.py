@@ -1,288 +1,357 @@
+import os
 import sqlite3
-from db import get_db_conn
+from functools import wraps
+from threading import Lock
+from cachetools import TTLCache
+from db import pool
+
+# SQLITE_MAX_VARIABLE_NUMBER on older SQLite builds
+MAX_VARIABLE_NUMBER = 999
+
+# IN (...) sizes used by batch deletes, so only a few distinct statements get prepared
+IN_CLAUSE_SIZES = (1, 4, 16, 64, 256, MAX_VARIABLE_NUMBER)
+
+# rows fetched per step when streaming a whole table
+STREAM_BATCH_SIZE = 500
+
+# read caches, invalidated by the write functions below
+CACHE_TTL = int(os.getenv("MOVIEDB_CACHE_TTL", "300"))
+CACHE_SIZE = 10_000
+
 
+class _ReadCache:
+    """
+    TTL cache for single-row reads, keyed by id.
+    Every invalidation bumps a generation counter; a read only stores its result
+    if no invalidation happened while it was querying, so a read racing a write
+    cannot put the old row back into the cache.
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._generation = 0
+        self._lock = Lock()
+
+    def cached(self, func):
+        @wraps(func)
+        def wrapper(key):
+            with self._lock:
+                try:
+                    return self._cache[key]
+                except KeyError:
+                    generation = self._generation
+
+            value = func(key)
+
+            with self._lock:
+                if generation == self._generation:
+                    self._cache[key] = value
+            return value
+
+        return wrapper
+
+    def invalidate(self, keys):
+        """
+        Drop cached rows for the given ids.
+        """
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._cache.pop(key, None)
+
+
+_actor_cache = _ReadCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+_movie_cache = _ReadCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+
+
+def _chunks(ids: list[int], size: int = MAX_VARIABLE_NUMBER):
+    """
+    Split ids into lists small enough to bind in a single IN (...) clause.
+    """
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def _padded_chunks(ids: list[int]):
+    """
+    Split ids into chunks padded with -1 up to the nearest IN_CLAUSE_SIZES entry.
+    Yields (size, chunk) pairs.
+    """
+    for chunk in _chunks(ids):
+        size = next(n for n in IN_CLAUSE_SIZES if n >= len(chunk))
+        yield size, chunk + [-1] * (size - len(chunk))
+
+
+def _in_statements(sql: str):
+    """
+    Prebuild sql, which contains an {ids} placeholder, for every IN_CLAUSE_SIZES entry.
+    """
+    return {n: sql.format(ids=', '.join(['?'] * n)) for n in IN_CLAUSE_SIZES}
+
+
+_DEL_ACTOR_ASSIGNMENTS = _in_statements('DELETE FROM movie_actor_through WHERE actor_id IN ({ids})')
+_DEL_ACTORS = _in_statements('DELETE FROM actor WHERE id IN ({ids})')
+_DEL_MOVIE_ASSIGNMENTS = _in_statements('DELETE FROM movie_actor_through WHERE movie_id IN ({ids})')
+_DEL_MOVIES = _in_statements('DELETE FROM movie WHERE id IN ({ids})')
+
+
+def _iter_rows(query: str, batch_size: int = STREAM_BATCH_SIZE):
+    """
+    Return a generator of query results in batches that holds one pooled connection.
+    The connection is acquired before returning, so pool errors are raised here
+    and not once the response has started; the connection is released when the
+    generator is exhausted or closed.
+    """
+    def batches():
+        with pool.acquire() as db:
+            cursor = db.cursor()
+            cursor.execute(query)
+            yield
+            while rows := cursor.fetchmany(batch_size):
+                yield rows
 
-def get_all_actors():
-    db = get_db_conn()
-    cursor = db.cursor()
-
-    try:
-        actors = cursor.execute('SELECT * FROM actor').fetchall()
-        return actors
-    finally:
-        db.close()
+    gen = batches()
+    next(gen)
+    return gen
 
 
+def iter_all_actors():
+    return _iter_rows('SELECT id, name, surname FROM actor')
+
+
+@_actor_cache.cached
 def get_actor_by_id(actor_id: int):
-    db = get_db_conn()
-    cursor = db.cursor()
-
-    try:
-        actor = cursor.execute('SELECT * FROM actor WHERE id = ?', (actor_id,)).fetchone()
+    with pool.acquire() as db:
+        cursor = db.cursor()
+        actor = cursor.execute('SELECT id, name, surname FROM actor WHERE id = ?', (actor_id,)).fetchone()
         return actor
-    finally:
-        db.close()
 
 
 def post_actor(name, surname):
-    db = get_db_conn()
-    cursor = db.cursor()
-
-    try:
-        # check duplicates
-        cursor.execute('SELECT id FROM actor WHERE name = ? AND surname = ?', (name, surname))
-        existing_actor = cursor.fetchone()
-        if existing_actor:
-            return "duplicate"
-
-        # insert new actor to actor table
-        cursor.execute('INSERT INTO actor (name, surname) VALUES (?, ?)', (name, surname))
-        new_id = cursor.lastrowid
-        db.commit()
-        return new_id
-    except sqlite3.Error as e:
-        db.rollback()
-        raise e
-    finally:
-        db.close()
+    with pool.acquire() as db:
+        cursor = db.cursor()
+
+        try:
+            # insert new actor to actor table, skipped if name and surname already exist
+            cursor.execute('INSERT INTO actor (name, surname) VALUES (?, ?) '
+                           'ON CONFLICT (name, surname) DO NOTHING RETURNING id', (name, surname))
+            new_actor = cursor.fetchone()
+            if new_actor is None:
+                db.rollback()
+                return "duplicate"
+
+            db.commit()
+            _actor_cache.invalidate([new_actor["id"]])
+            return new_actor["id"]
+        except sqlite3.Error as e:
+            db.rollback()
+            raise e
 
 
 def put_actor_by_id(actor_id: int, name: str, surname: str):
-    db = get_db_conn()
-    cursor = db.cursor()
-
-    try:
-        # check if actor already exists
-        cursor.execute('SELECT id FROM actor WHERE id = ?', (actor_id,))
-        if not cursor.fetchone():
-            return "not_found"
-
-        # check duplicates
-        cursor.execute('SELECT id FROM actor WHERE name = ? AND surname = ? AND id != ?', (name, surname, actor_id))
-        existing_actor = cursor.fetchone()
-        if existing_actor:
+    with pool.acquire() as db:
+        cursor = db.cursor()
+
+        try:
+            # update actor, duplicates are rejected by the unique (name, surname) index
+            cursor.execute('UPDATE actor SET name = ?, surname = ? WHERE id = ?', (name, surname, actor_id))
+            if cursor.rowcount == 0:
+                db.rollback()
+                return "not_found"
+
+            db.commit()
+            _actor_cache.invalidate([actor_id])
+            return "success"
+        except sqlite3.IntegrityError as e:
+            db.rollback()
             return "duplicate"
-
-        # update actor
-        cursor.execute('UPDATE actor SET name = ?, surname = ? WHERE id = ?', (name, surname, actor_id))
-        db.commit()
-        return "success"
-    except sqlite3.Error as e:
-        db.rollback()
-        raise e
-    finally:
-        db.close()
+        except sqlite3.Error as e:
+            db.rollback()
+            raise e
 
 
 def del_actor_by_id(actor_id: int):
-    db = get_db_conn()
-    cursor = db.cursor()
+    with pool.acquire() as db:
+        cursor = db.cursor()
 
-    try:
-        # check if actor already exists
-        cursor.execute('SELECT id FROM actor WHERE id = ?', (actor_id,))
-        if not cursor.fetchone():
-            return "not_found"
+        try:
+            # check if actor already exists
+            cursor.execute('SELECT id FROM actor WHERE id = ?', (actor_id,))
+            if not cursor.fetchone():
+                return "not_found"
 
-        # delete actor assignments from movie_actor_through table
-        cursor.execute('DELETE FROM movie_actor_through WHERE actor_id = ?', (actor_id,))
+            # delete actor assignments from movie_actor_through table
+            cursor.execute('DELETE FROM movie_actor_through WHERE actor_id = ?', (actor_id,))
 
-        # delete actor from actor table
-        cursor.execute('DELETE FROM actor WHERE id = ?', (actor_id,))
-        db.commit()
+            # delete actor from actor table
+            cursor.execute('DELETE FROM actor WHERE id = ?', (actor_id,))
+            db.commit()
+            _actor_cache.invalidate([actor_id])
 
-        return "success"
-    except sqlite3.Error as e:
-        db.rollback()
-        raise e
-    finally:
-        db.close()
+            return "success"
+        except sqlite3.Error as e:
+            db.rollback()
+            raise e
 
 
 def del_actors_by_ids(actor_ids: list[int]):
-    db = get_db_conn()
-    cursor = db.cursor()
-
-    try:
-        ids = ', '.join(['?'] * len(actor_ids))
+    with pool.acquire() as db:
+        cursor = db.cursor()
+        rows_deleted = 0
 
-        # delete all actor assignments for all selected actors from movie_actor_through table
-        cursor.execute(f'DELETE FROM movie_actor_through WHERE actor_id IN ({ids})', actor_ids)
+        # one transaction for all chunks, committed or rolled back as a whole
+        with db:
+            for size, chunk in _padded_chunks(actor_ids):
+                # delete all actor assignments for all selected actors from movie_actor_through table
+                cursor.execute(_DEL_ACTOR_ASSIGNMENTS[size], chunk)
 
-        # delete all selected actors from actor table
-        cursor.execute('DELETE FROM actor WHERE id IN (' + ids + ')', actor_ids)
+                # delete all selected actors from actor table
+                cursor.execute(_DEL_ACTORS[size], chunk)
+                rows_deleted += cursor.rowcount
 
-        rows_deleted = cursor.rowcount
-        db.commit()
+        _actor_cache.invalidate(actor_ids)
         return rows_deleted
-    except sqlite3.Error as e:
-        db.rollback()
-        raise e
-    finally:
-        db.close()
 
 
-def get_all_movies():
-    db = get_db_conn()
-    cursor = db.cursor()
-
-    try:
-        movies = cursor.execute('SELECT * FROM movie').fetchall()
-        return movies
-    finally:
-        db.close()
+def iter_all_movies():
+    return _iter_rows('SELECT id, title, director, year, description FROM movie')
 
 
+@_movie_cache.cached
 def get_movie_by_id(movie_id: int):
-    db = get_db_conn()
-    cursor = db.cursor()
-
-    try:
-        movie = cursor.execute('SELECT * FROM movie WHERE id = ?', (movie_id,)).fetchone()
+    with pool.acquire() as db:
+        cursor = db.cursor()
+        movie = cursor.execute('SELECT id, title, director, year, description FROM movie WHERE id = ?', (movie_id,)).fetchone()
         return movie
-    finally:
-        db.close()
 
 
 def post_movie(title: str, director: str, year: int, description: str, actor_ids: list[int]):
-    db = get_db_conn()
-    cursor = db.cursor()
-
-    try:
-        # check duplicates
-        cursor.execute('SELECT id FROM movie WHERE title = ? AND year = ?', (title, year))
-        existing_movie = cursor.fetchone()
-        if existing_movie:
-            return "duplicate"
-
-        # insert movie into movie table
-        cursor.execute('INSERT INTO movie (title, director, year, description) VALUES (?, ?, ?, ?)', (title, director, year, description))
-        new_id = cursor.lastrowid
-
-        # insert actor assignments into movie_actor_through table
-        if actor_ids:
-            # tuples [(movie_id, actor_id1), (movie_id, actor_id2), ...]
-            unique_actor_ids = list(set(actor_ids))
-            t = [(new_id, a_id) for a_id in unique_actor_ids]
-            cursor.executemany('INSERT INTO movie_actor_through (movie_id, actor_id) VALUES (?, ?)', t)
-
-        db.commit()
-        return new_id
-    except sqlite3.IntegrityError as e:
-        db.rollback()
-        return "invalid_actors"
-    except sqlite3.Error as e:
-        db.rollback()
-        raise e
-    finally:
-        db.close()
-
-
-def put_movie_by_id(movie_id: int, title: str, director: str, year: int, description: str, actor_ids: list[int]):
-    db = get_db_conn()
-    cursor = db.cursor()
-
-    try:
-        # check if movie already exists
-        cursor.execute('SELECT id FROM movie WHERE id = ?', (movie_id,))
-        if not cursor.fetchone():
-            return "not_found"
-
-        # check duplicates
-        cursor.execute('SELECT id FROM movie WHERE title = ? AND year = ? AND id != ?', (title, year, movie_id))
-        existing_movie = cursor.fetchone()
-        if existing_movie:
-            return "duplicate"
-
-        # update movie
-        cursor.execute('UPDATE movie SET title = ?, director = ?, year = ?, description = ? WHERE id = ?', (title, director, year, description, movie_id))
-
-        # update assignments in movie_actor_through table
-        if actor_ids is not None:
-            cursor.execute('DELETE FROM movie_actor_through WHERE movie_id = ?', (movie_id,))
-
+    with pool.acquire() as db:
+        cursor = db.cursor()
+
+        try:
+            # insert movie into movie table, skipped if title and year already exist
+            cursor.execute('INSERT INTO movie (title, director, year, description) VALUES (?, ?, ?, ?) '
+                           'ON CONFLICT (title, year) DO NOTHING RETURNING id', (title, director, year, description))
+            new_movie = cursor.fetchone()
+            if new_movie is None:
+                db.rollback()
+                return "duplicate"
+            new_id = new_movie["id"]
+
+            # insert actor assignments into movie_actor_through table
             if actor_ids:
+                # tuples [(movie_id, actor_id1), (movie_id, actor_id2), ...]
                 unique_actor_ids = list(set(actor_ids))
-                t = [(movie_id, a_id) for a_id in unique_actor_ids]
+                t = [(new_id, a_id) for a_id in unique_actor_ids]
                 cursor.executemany('INSERT INTO movie_actor_through (movie_id, actor_id) VALUES (?, ?)', t)
 
-        db.commit()
-        return "success"
-    except sqlite3.IntegrityError as e:
-        db.rollback()
-        return "invalid_actors"
-    except sqlite3.Error as e:
-        db.rollback()
-        raise e
-    finally:
-        db.close()
+            db.commit()
+            _movie_cache.invalidate([new_id])
+            return new_id
+        except sqlite3.IntegrityError as e:
+            db.rollback()
+            return "invalid_actors"
+        except sqlite3.Error as e:
+            db.rollback()
+            raise e
 
 
-def del_movie_by_id(movie_id: int):
-    db = get_db_conn()
-    cursor = db.cursor()
+def put_movie_by_id(movie_id: int, title: str, director: str, year: int, description: str, actor_ids: list[int]):
+    with pool.acquire() as db:
+        cursor = db.cursor()
+
+        try:
+            # update movie, duplicates are rejected by the unique (title, year) index
+            try:
+                cursor.execute('UPDATE movie SET title = ?, director = ?, year = ?, description = ? WHERE id = ?', (title, director, year, description, movie_id))
+            except sqlite3.IntegrityError as e:
+                db.rollback()
+                return "duplicate"
+            if cursor.rowcount == 0:
+                db.rollback()
+                return "not_found"
+
+            # update assignments in movie_actor_through table
+            if actor_ids is not None:
+                cursor.execute('DELETE FROM movie_actor_through WHERE movie_id = ?', (movie_id,))
+
+                if actor_ids:
+                    unique_actor_ids = list(set(actor_ids))
+                    t = [(movie_id, a_id) for a_id in unique_actor_ids]
+                    cursor.executemany('INSERT INTO movie_actor_through (movie_id, actor_id) VALUES (?, ?)', t)
+
+            db.commit()
+            _movie_cache.invalidate([movie_id])
+            return "success"
+        except sqlite3.IntegrityError as e:
+            db.rollback()
+            return "invalid_actors"
+        except sqlite3.Error as e:
+            db.rollback()
+            raise e
 
-    try:
-        # check if movie already exists
-        cursor.execute('SELECT * FROM movie WHERE id = ?', (movie_id,))
-        if not cursor.fetchone():
-            return "not_found"
 
-        # delete actor assignments from movie_actor_through table
-        cursor.execute('DELETE FROM movie_actor_through WHERE movie_id = ?', (movie_id,))
+def del_movie_by_id(movie_id: int):
+    with pool.acquire() as db:
+        cursor = db.cursor()
 
-        # delete movie from movie table
-        cursor.execute('DELETE FROM movie WHERE id = ?', (movie_id,))
-        db.commit()
-        return "success"
-    except sqlite3.Error as e:
-        db.rollback()
-        raise e
-    finally:
-        db.close()
+        try:
+            # check if movie already exists
+            cursor.execute('SELECT id FROM movie WHERE id = ?', (movie_id,))
+            if not cursor.fetchone():
+                return "not_found"
 
+            # delete actor assignments from movie_actor_through table
+            cursor.execute('DELETE FROM movie_actor_through WHERE movie_id = ?', (movie_id,))
 
-def del_movies_by_ids(movie_ids: list[int]):
-    db = get_db_conn()
-    cursor = db.cursor()
+            # delete movie from movie table
+            cursor.execute('DELETE FROM movie WHERE id = ?', (movie_id,))
+            db.commit()
+            _movie_cache.invalidate([movie_id])
+            return "success"
+        except sqlite3.Error as e:
+            db.rollback()
+            raise e
 
-    try:
-        ids = ', '.join(['?'] * len(movie_ids))
 
-        # delete all actor assignments for all selected movies
-        cursor.execute(f'DELETE FROM movie_actor_through WHERE movie_id IN ({ids})', movie_ids)
+def del_movies_by_ids(movie_ids: list[int]):
+    with pool.acquire() as db:
+        cursor = db.cursor()
+        rows_deleted = 0
 
-        # delete all selected movies
-        cursor.execute('DELETE FROM movie WHERE id IN (' + ids + ')', movie_ids)
+        # one transaction for all chunks, committed or rolled back as a whole
+        with db:
+            for size, chunk in _padded_chunks(movie_ids):
+                # delete all actor assignments for all selected movies
+                cursor.execute(_DEL_MOVIE_ASSIGNMENTS[size], chunk)
 
-        rows_deleted = cursor.rowcount
-        db.commit()
+                # delete all selected movies
+                cursor.execute(_DEL_MOVIES[size], chunk)
+                rows_deleted += cursor.rowcount
 
+        _movie_cache.invalidate(movie_ids)
         return rows_deleted
-    except sqlite3.Error as e:
-        db.rollback()
-        raise e
-    finally:
-        db.close()
 
 
 def get_actors_for_specific_movie(movie_id: int):
-    db = get_db_conn()
-    cursor = db.cursor()
-
-    try:
-        # check if movie already exists
-        cursor.execute('SELECT * FROM movie WHERE id = ?', (movie_id,))
-        movie = cursor.fetchone()
-        if not movie:
-            return "not_found"
-
-        # retrieve all actors assigned to a specific movie
-        cursor.execute('SELECT a.id, a.name, a.surname FROM actor a JOIN movie_actor_through mat ON a.id = mat.actor_id WHERE mat.movie_id = ?', (movie_id,))
-        actors = cursor.fetchall()
-        return actors, movie
-    except sqlite3.Error as e:
-        db.rollback()
-        raise e
-    finally:
-        db.close()
+    with pool.acquire() as db:
+        cursor = db.cursor()
+
+        try:
+            # retrieve the movie together with all actors assigned to it in one query,
+            # a movie without actors comes back as a single row with NULL actor columns
+            cursor.execute('SELECT m.id AS movie_id, m.title, a.id, a.name, a.surname FROM movie m '
+                           'LEFT JOIN movie_actor_through mat ON mat.movie_id = m.id '
+                           'LEFT JOIN actor a ON a.id = mat.actor_id '
+                           'WHERE m.id = ?', (movie_id,))
+            rows = cursor.fetchall()
+            if not rows:
+                return "not_found"
+
+            movie = {"id": rows[0]["movie_id"], "title": rows[0]["title"]}
+            actors = [{"id": r["id"], "name": r["name"], "surname": r["surname"]} for r in rows if r["id"] is not None]
+            return actors, movie
+        except sqlite3.Error as e:
+            db.rollback()
+            raise e
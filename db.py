@@ -1,11 +1,104 @@
+import os
+import queue
 import sqlite3
+from contextlib import contextmanager
+
+DB_PATH = os.getenv("MOVIEDB_PATH", "movies-extended.db")
+POOL_SIZE = int(os.getenv("MOVIEDB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.getenv("MOVIEDB_POOL_TIMEOUT", "5"))
+MMAP_SIZE = int(os.getenv("MOVIEDB_MMAP_SIZE", str(256 * 1024 * 1024)))
+CACHED_STATEMENTS = 256
+
+
+# (cursor.description, column names) of the last statement seen by dict_factory
+_last_fields = (None, None)
+
+
+def dict_factory(cursor, row):
+    """
+    Build a dict for each fetched row so results can be returned as-is.
+    Column names are computed once per executed statement, not per row.
+    """
+    global _last_fields
+    description, fields = _last_fields
+    if cursor.description is not description:
+        description = cursor.description
+        fields = [column[0] for column in description]
+        _last_fields = (description, fields)
+    return dict(zip(fields, row))
 
 
 def get_db_conn():
     """
     Create and return a database connection.
     """
-    db = sqlite3.connect('movies-extended.db')
+    db = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
     db.execute("PRAGMA foreign_keys = ON")
-    db.row_factory = sqlite3.Row
-    return db
\ No newline at end of file
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute("PRAGMA synchronous = NORMAL")
+    db.execute("PRAGMA temp_store = MEMORY")
+    db.execute("PRAGMA cache_size = -64000")
+    db.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    db.row_factory = dict_factory
+    return db
+
+
+def init_db(db):
+    """
+    Create the indexes used by the duplicate checks if they are missing.
+    """
+    with db:
+        db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_actor_name_surname ON actor (name, surname)")
+        db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_movie_title_year ON movie (title, year)")
+
+
+class PoolUnavailableError(Exception):
+    """
+    Raised when the pool cannot hand out a database connection.
+    """
+
+
+class DBPool:
+    """
+    Fixed-size pool of database connections reused across requests.
+    """
+
+    def __init__(self, size: int, timeout: float):
+        self.size = size
+        self.timeout = timeout
+        self._conns = queue.Queue(maxsize=size)
+        self._opened = False
+
+    def open(self):
+        for _ in range(self.size):
+            self._conns.put(get_db_conn())
+        self._opened = True
+
+    def close(self):
+        self._opened = False
+        while not self._conns.empty():
+            self._conns.get_nowait().close()
+
+    @contextmanager
+    def acquire(self):
+        """
+        Borrow a connection from the pool and return it when done.
+        Any transaction left open by the caller is rolled back.
+        Raises PoolUnavailableError if the pool is not open or no connection
+        is free within the timeout.
+        """
+        if not self._opened:
+            raise PoolUnavailableError("Database pool is not open! Call pool.open() on startup.")
+        try:
+            db = self._conns.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolUnavailableError("No database connection available! Please try again later.") from None
+        try:
+            yield db
+        finally:
+            if db.in_transaction:
+                db.rollback()
+            self._conns.put(db)
+
+
+pool = DBPool(POOL_SIZE, POOL_TIMEOUT)
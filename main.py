@@ -1,7 +1,27 @@
-from fastapi import FastAPI, HTTPException, Body
+import os
+from contextlib import asynccontextmanager
+from functools import lru_cache
+import anyio.to_thread
+from fastapi import FastAPI, HTTPException, Body, Query, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import orjson
 import requests
-from typing import Any, List
+from typing import List
 import crud
+from schemas import ActorIn, MovieIn
+from db import pool, init_db, PoolUnavailableError
+
+# number of worker threads running the synchronous endpoints
+THREAD_LIMIT = int(os.getenv("MOVIEDB_THREAD_LIMIT", "100"))
+
+# /sum operands are bounded so the result fits the 64-bit integers orjson can encode
+SUM_LIMIT = 2**62
+
+# shared HTTP session, keeps connections to Nominatim alive between requests
+http_session = requests.Session()
+http_session.headers["User-Agent"] = "Mozilla/5.0"
+# seconds to wait for Nominatim before giving up
+GEOCODE_TIMEOUT = float(os.getenv("MOVIEDB_GEOCODE_TIMEOUT", "10"))
 
 tags_metadata = [
     {
@@ -19,11 +39,48 @@ tags_metadata = [
 ]
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREAD_LIMIT
+
+    # open pooled database connections on startup, close them on shutdown
+    pool.open()
+    with pool.acquire() as db:
+        init_db(db)
+
+    # build the OpenAPI schema now, FastAPI keeps it for every later /openapi.json request
+    app.openapi()
+    yield
+    pool.close()
+    http_session.close()
+
+
 app = FastAPI(
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     openapi_tags=tags_metadata,
     swagger_ui_parameters={"operationsSorter": "alpha"}
 )
 
+def stream_json_array(batches):
+    """
+    Encode batches of rows as one JSON array, a batch at a time.
+    """
+    yield b"["
+    first = True
+    for rows in batches:
+        # drop the brackets of each encoded batch and join them with commas
+        chunk = orjson.dumps(rows)[1:-1]
+        yield chunk if first else b"," + chunk
+        first = False
+    yield b"]"
+
+
+@app.exception_handler(PoolUnavailableError)
+async def pool_unavailable_handler(request: Request, exc: PoolUnavailableError):
+    return ORJSONResponse(status_code=503, content={"detail": str(exc)})
+
+
 @app.get("/", tags=["Other"])
 async def root():
     return {"message": "Hello World"}
@@ -35,16 +92,30 @@ async def say_hello(name: str):
 
 
 @app.get("/sum", tags=["Other"])
-def sum(x: int = 0, y: int = 10):
+def sum(x: int = Query(0, ge=-SUM_LIMIT, le=SUM_LIMIT), y: int = Query(10, ge=-SUM_LIMIT, le=SUM_LIMIT)):
     return x+y
 
 
+@lru_cache(maxsize=4096)
+def reverse_geocode(lat6: int, lon6: int):
+    """
+    Fetch the Nominatim reverse lookup for coordinates given in micro-degrees.
+    """
+    url = f"https://nominatim.openstreetmap.org/reverse?format=jsonv2&lat={lat6 / 1e6}&lon={lon6 / 1e6}"
+    response = http_session.get(url, timeout=GEOCODE_TIMEOUT)
+    # error responses are raised, not cached
+    response.raise_for_status()
+    return response.json()
+
+
 @app.get("/geocode", tags=["Other"])
-def sum(lat: float, lon: float):
-    url = f"https://nominatim.openstreetmap.org/reverse?format=jsonv2&lat={lat}&lon={lon}"
-    response = requests.get(url, headers={"User-Agent": "Mozilla/5.0"})
+def geocode(lat: float = Query(ge=-90, le=90), lon: float = Query(ge=-180, le=180)):
     # http://127.0.0.1:8000/geocode?lat=50.0680275&lon=19.9098668
-    return response.json()
+    # coordinates are rounded to ~0.1 m so nearby lookups share a cache entry
+    try:
+        return reverse_geocode(round(lat * 1e6), round(lon * 1e6))
+    except requests.RequestException as e:
+        raise HTTPException(status_code=502, detail=f"Geocoding service error: {e}")
 
 
 # ---------------------------------
@@ -58,8 +129,7 @@ def get_actors():
     """
     Retrieve a list of all actors from the database.
     """
-    rows = crud.get_all_actors()
-    return [dict(row) for row in rows]
+    return StreamingResponse(stream_json_array(crud.iter_all_actors()), media_type="application/json")
 
 
 @app.get('/actors/{actor_id}', tags=["Actors"])
@@ -71,55 +141,43 @@ def get_single_actor(actor_id:int):
     row = crud.get_actor_by_id(actor_id)
     if row is None:
         raise HTTPException(status_code=404, detail="Actor not found!")
-    return dict(row)
+    return row
 
 
 @app.post('/actors', tags=["Actors"])
-def add_actor(params: dict[str, Any]):
+def add_actor(params: ActorIn):
     """
     Add an actor to the database.
-    Checks for duplicates before inserting. Returns the ID of the newly added actor.
+    Returns 409 if the actor already exists, otherwise the ID of the newly added actor.
     """
-    name = params.get("name")
-    surname = params.get("surname")
-
-    if not name or not surname:
-        raise HTTPException(status_code=400, detail="All fields: name and surname are required!")
-
     try:
-        result = crud.post_actor(name, surname)
+        result = crud.post_actor(params.name, params.surname)
 
         if result == "duplicate":
             raise HTTPException(status_code=409, detail="Actor already exists!")
         return {"message": "Actor has been added successfully!", "id": result}
-    except HTTPException:
+    except (HTTPException, PoolUnavailableError):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.put('/actors/{actor_id}', tags=["Actors"])
-def edit_actor(actor_id: int, params: dict[str, Any]):
+def edit_actor(actor_id: int, params: ActorIn):
     """
     Edit and update an actor from the database.
-    Checks for duplicates before updating.
+    Returns 409 if another actor has the same name and surname.
     Returns 404 if actor is not found.
     """
-    new_name = params.get("name")
-    new_surname = params.get("surname")
-
-    if not new_name or not new_surname:
-        raise HTTPException(status_code=400, detail="All fields: name and surname are required!")
-
     try:
-        result = crud.put_actor_by_id(actor_id, new_name, new_surname)
+        result = crud.put_actor_by_id(actor_id, params.name, params.surname)
 
         if result == "duplicate":
             raise HTTPException(status_code=409, detail="Actor already exists! Update not allowed!")
         elif result == "not_found":
             raise HTTPException(status_code=404, detail="Actor not found!")
         return {"message": f"Actor {actor_id} updated successfully!"}
-    except HTTPException:
+    except (HTTPException, PoolUnavailableError):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -144,7 +202,7 @@ def del_actors(actor_ids: List[int] = Body(...)):
                 "deleted_count": rows_deleted
             }
         return {"message": f"All selected actors with their associations deleted successfully!", "deleted_ids": actor_ids, "deleted_count": rows_deleted}
-    except HTTPException:
+    except (HTTPException, PoolUnavailableError):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -161,7 +219,7 @@ def del_actor(actor_id: int):
         if result == "not_found":
             raise HTTPException(status_code=404, detail="Actor not found!")
         return {"message": f"Actor with id {actor_id} deleted successfully!"}
-    except HTTPException:
+    except (HTTPException, PoolUnavailableError):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -173,8 +231,7 @@ def get_movies():
     """
     Retrieve a list of all movies from the database.
     """
-    rows = crud.get_all_movies()
-    return [dict(row) for row in rows]
+    return StreamingResponse(stream_json_array(crud.iter_all_movies()), media_type="application/json")
 
 
 @app.get('/movies/{movie_id}', tags=["Movies"])
@@ -186,26 +243,19 @@ def get_single_movie(movie_id:int):
     row = crud.get_movie_by_id(movie_id)
     if row is None:
         raise HTTPException(status_code=404, detail="Movie not found!")
-    return dict(row)
+    return row
 
 
 @app.post('/movies', tags=["Movies"])
-def add_movie(params: dict[str, Any]):
+def add_movie(params: MovieIn):
     """
     Add a new movie to the database.
-    Checks for duplicates before inserting. Returns the ID of the newly created movie.
+    Returns 409 if the movie already exists, otherwise the ID of the newly created movie.
     """
-    title = params.get("title")
-    director = params.get("director")
-    year = params.get("year")
-    description = params.get("description")
-    actor_ids = params.get("actor_ids", [])
-
-    if not title or not year or not director:
-        raise HTTPException(status_code=400, detail="Fields title/director/year are required!")
+    actor_ids = params.actor_ids or []
 
     try:
-        result = crud.post_movie(title, director, year, description, actor_ids)
+        result = crud.post_movie(params.title, params.director, params.year, params.description, actor_ids)
 
         if result == "duplicate":
             raise HTTPException(status_code=409, detail="Movie already exists!")
@@ -215,30 +265,23 @@ def add_movie(params: dict[str, Any]):
                 "movie_id": result,
                 "added_actor_count": len(set(actor_ids))
                 }
-    except HTTPException:
+    except (HTTPException, PoolUnavailableError):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.put('/movies/{movie_id}', tags=["Movies"])
-def edit_movie(movie_id: int, params: dict[str, Any]):
+def edit_movie(movie_id: int, params: MovieIn):
     """
     Update movie details and refresh actor assignments.
-    Checks for duplicates before updating.
+    Returns 409 if another movie has the same title and year.
     Returns 404 if the movie is not found.
     """
-    new_title = params.get("title")
-    new_director = params.get("director")
-    new_year = params.get("year")
-    new_description = params.get("description")
-    new_actor_ids = params.get("actor_ids")
-
-    if not new_title or not new_year or not new_director:
-        raise HTTPException(status_code=400, detail="Fields title/director/year are required!")
+    new_actor_ids = params.actor_ids
 
     try:
-        result = crud.put_movie_by_id(movie_id, new_title, new_director, new_year, new_description, new_actor_ids)
+        result = crud.put_movie_by_id(movie_id, params.title, params.director, params.year, params.description, new_actor_ids)
         if result == "duplicate":
             raise HTTPException(status_code=409, detail="Movie already exists! Update not allowed!")
         elif result == "invalid_actors":
@@ -248,7 +291,7 @@ def edit_movie(movie_id: int, params: dict[str, Any]):
             "id": movie_id,
             "updated_actors_count": len(set(new_actor_ids or []))
         }
-    except HTTPException:
+    except (HTTPException, PoolUnavailableError):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -273,7 +316,7 @@ def del_movies(movie_ids: List[int] = Body(...)):
                 "actual_deleted_count": rows_deleted
             }
         return {"message": f"All selected movies with their associations deleted successfully!", "deleted_ids": movie_ids}
-    except HTTPException:
+    except (HTTPException, PoolUnavailableError):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -290,7 +333,7 @@ def del_movie(movie_id: int):
         if result == "not_found":
             raise HTTPException(status_code=404, detail="Movie not found!")
         return {"message": f"Movie with id {movie_id} deleted successfully!"}
-    except HTTPException:
+    except (HTTPException, PoolUnavailableError):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -309,9 +352,16 @@ def get_actors_for_movie(movie_id: int):
         actors, movie = result
         return {
             "movie_title": movie["title"],
-            "actors": [dict(row) for row in actors]
+            "actors": actors
         }
-    except HTTPException:
+    except (HTTPException, PoolUnavailableError):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # "auto" picks uvloop and httptools when they are installed (uvloop is not available on Windows)
+    uvicorn.run("main:app", loop="auto", http="auto", workers=int(os.getenv("MOVIEDB_WORKERS", "1")))
@@ -0,0 +1,21 @@
+from pydantic import BaseModel, Field
+
+
+class ActorIn(BaseModel):
+    """
+    Request body for adding or editing an actor.
+    """
+    name: str = Field(min_length=1)
+    surname: str = Field(min_length=1)
+
+
+class MovieIn(BaseModel):
+    """
+    Request body for adding or editing a movie.
+    On edit, actor_ids left out keeps the current actor assignments.
+    """
+    title: str = Field(min_length=1)
+    director: str = Field(min_length=1)
+    year: int
+    description: str
+    actor_ids: list[int] | None = None